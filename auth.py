@@ -3,15 +3,31 @@ Authentication utilities for Linac QA System.
 Simple session-based authentication suitable for internal hospital use.
 """
 
-from datetime import datetime, timedelta
+import time
+from functools import lru_cache
 from passlib.context import CryptContext
 from itsdangerous import URLSafeTimedSerializer
-from fastapi import Request, HTTPException, status
+from fastapi import Depends, Request, HTTPException, status
 from fastapi.responses import RedirectResponse
+from sqlalchemy import exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from database import get_async_db
+
 # Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Cost 10 keeps a login verify around 70ms on typical hospital hardware
+# (cost 12, the passlib default, is ~4x slower). Hashes made at a higher
+# cost are flagged for update and re-hashed on the next successful login.
+BCRYPT_ROUNDS = 10
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__ident="2b",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 
 # Session configuration
 SECRET_KEY = "change-this-to-a-secure-random-string-in-production"  # TODO: Move to environment variable
@@ -31,42 +47,129 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
-def create_session_token(user_id: int, username: str) -> str:
-    """Create a signed session token."""
-    data = {
-        "user_id": user_id,
-        "username": username,
-        "created": datetime.utcnow().isoformat()
-    }
-    return serializer.dumps(data)
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+    Verify a password and return (valid, new_hash).
+    new_hash is set when the stored hash uses outdated settings and should be replaced.
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def warm_up_password_hashing():
+    """
+    Load and self-test the bcrypt backend now rather than on the first login.
+    passlib probes the backend lazily on first use, which can add ~100ms.
+    Refuses to start unless the native `bcrypt` package is in use, since the
+    pure-Python fallback is ~100x slower.
+    """
+    from passlib.hash import bcrypt
+    
+    backend = bcrypt.get_backend()
+    if backend != "bcrypt":
+        raise RuntimeError(
+            f"passlib is using the '{backend}' bcrypt backend; install the 'bcrypt' package"
+        )
+    pwd_context.hash("warmup")
+
+
+def create_session_token(user_id: int) -> str:
+    """
+    Create a signed session token.
+    Only the user id is stored; itsdangerous signs its own timestamp,
+    which is what max_age is checked against.
+    """
+    return serializer.dumps({"uid": user_id})
 
 
-def verify_session_token(token: str, max_age_hours: int = SESSION_EXPIRE_HOURS) -> dict | None:
-    """Verify and decode a session token."""
+@lru_cache(maxsize=4096)
+def _decode_token_cached(token: str) -> tuple[int, float] | None:
+    """
+    Verify a session token once and remember (user_id, expiry_ts).
+    Tokens are immutable, so repeat requests with the same cookie only
+    need an expiry check instead of another HMAC + JSON decode.
+    """
     try:
-        data = serializer.loads(token, max_age=max_age_hours * 3600)
-        return data
+        data, signed_at = serializer.loads(
+            token, max_age=SESSION_EXPIRE_HOURS * 3600, return_timestamp=True
+        )
     except Exception:
         return None
+    if "uid" not in data:
+        return None  # Token from an older payload format; force a fresh login
+    return data["uid"], signed_at.timestamp() + SESSION_EXPIRE_HOURS * 3600
 
 
 def get_current_user(request: Request, db: Session):
-    """Get the current logged-in user from session cookie."""
+    """
+    Get the current logged-in user from session cookie.
+    The result is memoised on request.state so repeat calls within the
+    same request (e.g. require_auth -> require_admin) skip the lookup.
+    """
+    from models import User
+    
+    if hasattr(request.state, "user"):
+        return request.state.user
+    
+    user_id = _session_user_id(request)
+    # Session.get() checks the identity map before issuing a SELECT
+    user = db.get(User, user_id) if user_id is not None else None
+    request.state.user = user if user and user.active else None
+    return request.state.user
+
+
+# Short-lived "this user is active" cache for the JSON API dependency:
+# user_id -> monotonic time until which no users-table check is needed.
+# Deactivating a user takes effect here within ACTIVE_USER_TTL seconds
+# (immediately in the worker that saved the change).
+ACTIVE_USER_TTL = 300
+_ACTIVE_USER_CACHE_MAX = 10_000
+_active_user_cache: dict[int, float] = {}
+
+
+def forget_active_user(user_id: int):
+    """Force the next API request by this user to re-check the users table."""
+    _active_user_cache.pop(user_id, None)
+
+
+async def current_user_id(request: Request, db: AsyncSession = Depends(get_async_db)) -> int:
+    """
+    Dependency for JSON API routes: the id of the logged-in, active user.
+    Raises 401 otherwise. Repeat requests within ACTIVE_USER_TTL cost no query.
+    """
     from models import User
     
+    user_id = _session_user_id(request)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    
+    now = time.monotonic()
+    if now >= _active_user_cache.get(user_id, 0):
+        result = await db.execute(select(User.id).where(User.id == user_id, User.active == True))
+        if result.first() is None:
+            forget_active_user(user_id)
+            raise HTTPException(status_code=401, detail="Authentication required")
+        if len(_active_user_cache) >= _ACTIVE_USER_CACHE_MAX:
+            _active_user_cache.clear()
+        _active_user_cache[user_id] = now + ACTIVE_USER_TTL
+    
+    return user_id
+
+
+def _session_user_id(request: Request) -> int | None:
+    """Return the user id from a valid, unexpired session cookie, or None."""
     token = request.cookies.get(SESSION_COOKIE_NAME)
     if not token:
         return None
     
-    session_data = verify_session_token(token)
-    if not session_data:
+    session = _decode_token_cached(token)
+    if not session:
         return None
     
-    user = db.query(User).filter(User.id == session_data["user_id"]).first()
-    if not user or not user.active:
+    user_id, expiry_ts = session
+    if time.time() >= expiry_ts:
         return None
     
-    return user
+    return user_id
 
 
 def require_auth(request: Request, db: Session):
@@ -95,7 +198,7 @@ def create_default_admin(db: Session):
     """Create default admin user if no users exist."""
     from models import User
     
-    if db.query(User).count() == 0:
+    if not db.query(exists().where(User.id.isnot(None))).scalar():
         admin = User(
             username="admin",
             email="admin@hospital.local",
@@ -124,3 +227,18 @@ def log_audit(db: Session, user: str, action: str, details: str, ip_address: str
     )
     db.add(entry)
     db.commit()
+
+
+def log_audit_deferred(user: str, action: str, details: str, ip_address: str = None):
+    """
+    Log an audit entry using its own short-lived session.
+    Intended for FastAPI BackgroundTasks, so the INSERT + commit runs after
+    the response has been sent instead of on the request's critical path.
+    """
+    from database import SessionLocal
+    
+    db = SessionLocal()
+    try:
+        log_audit(db, user, action, details, ip_address)
+    finally:
+        db.close()
@@ -3,23 +3,39 @@ Linac QA Management System - FastAPI Application
 Main entry point and route definitions.
 """
 
+import logging
 import os
-import json
+import re
+
+import orjson
 from datetime import datetime, date, timedelta
-from typing import Optional
+from typing import Annotated, Optional
 
-from fastapi import FastAPI, Request, Depends, Form, HTTPException, status
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, FileResponse
+from fastapi import FastAPI, Request, Depends, Form, HTTPException, BackgroundTasks, status
+from fastapi.responses import Response, HTMLResponse, RedirectResponse, ORJSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
-
-from database import get_db, init_db, backup_database, list_backups, export_to_json
-from models import User, Unit, QAReport, QATest, OutputReading, AuditLog, SASQART_TESTS
+from pydantic import BaseModel, Field
+from jinja2 import FileSystemBytecodeCache
+from starlette.middleware.gzip import GZipMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload, raiseload
+from starlette.datastructures import FormData
+from sqlalchemy import func, and_, or_, insert, exists, select, bindparam
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import (
+    get_db, get_async_db, async_engine, init_db, QueryCounter, current_query_counter, DATABASE_LOCATION,
+    backup_database, list_backups, iter_export_ndjson
+)
+from models import (
+    User, Unit, QAReport, QATest, OutputReading, AuditLog,
+    SASQART_TESTS, SASQART_TESTS_BY_ID, SASQART_TESTS_JSON
+)
 from auth import (
-    hash_password, verify_password, create_session_token, 
-    get_current_user, create_default_admin, log_audit,
+    hash_password, verify_and_update_password, create_session_token, 
+    get_current_user, current_user_id, forget_active_user, create_default_admin, log_audit, log_audit_deferred,
+    warm_up_password_hashing,
     SESSION_COOKIE_NAME
 )
 
@@ -27,9 +43,18 @@ from auth import (
 app = FastAPI(
     title="Linac QA Management System",
     description="Quality Assurance management for medical linear accelerators",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+DEBUG = os.environ.get("DEBUG") == "1"
+
+logger = logging.getLogger("linac_qa")
+
+# Compress larger responses (export, history pages); streamed responses
+# are compressed chunk by chunk
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Setup directories
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
@@ -46,6 +71,53 @@ app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 # Setup Jinja2 templates
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 
+# Outside debug mode, compile templates once per process: no stat() per render
+# and compiled bytecode is reused across restarts. Set DEBUG=1 to edit live.
+# With no directory argument Jinja uses a per-user _jinja2-cache-<uid> temp
+# directory created with mode 0700 and refuses one owned by another user.
+if not DEBUG:
+    templates.env.auto_reload = False
+    templates.env.bytecode_cache = FileSystemBytecodeCache()
+
+
+# =============================================================================
+# SQL QUERY BUDGETS
+# =============================================================================
+
+def max_queries(limit: int):
+    """
+    Pin the number of SQL statements a route may run per request.
+    Exceeding it raises in DEBUG mode and logs a warning otherwise, so an
+    N+1 (e.g. a relationship falling back to lazy loading) is caught early.
+    """
+    def decorator(endpoint):
+        endpoint.max_queries = limit
+        return endpoint
+    return decorator
+
+
+@app.middleware("http")
+async def count_queries(request: Request, call_next):
+    """Count SQL statements per request and enforce @max_queries budgets."""
+    counter = QueryCounter()
+    token = current_query_counter.set(counter)
+    try:
+        response = await call_next(request)
+    finally:
+        current_query_counter.reset(token)
+    
+    endpoint = request.scope.get("endpoint")
+    name = getattr(endpoint, "__name__", request.url.path)
+    logger.debug("%s: %d SQL queries", name, counter.count)
+    
+    limit = getattr(endpoint, "max_queries", None)
+    if limit is not None and counter.count > limit:
+        message = f"{name} ran {counter.count} SQL queries (limit {limit})"
+        if DEBUG:
+            raise RuntimeError(message)
+        logger.warning(message)
+    return response
+
 
 # =============================================================================
 # STARTUP EVENTS
@@ -54,6 +126,15 @@ templates = Jinja2Templates(directory=TEMPLATES_DIR)
 @app.on_event("startup")
 async def startup():
     """Initialize database and default data on startup."""
+    # With multiple workers the parent process initializes once (see
+    # __main__) so workers don't race each other creating tables/defaults
+    if os.environ.get("LINAC_QA_DB_INITIALIZED") != "1":
+        initialize_database()
+    warm_up_password_hashing()
+
+
+def initialize_database():
+    """Create tables and indexes, then seed the default admin and units."""
     init_db()
     db = next(get_db())
     create_default_admin(db)
@@ -63,7 +144,7 @@ async def startup():
 
 def create_default_units(db: Session):
     """Create default linac units if none exist."""
-    if db.query(Unit).count() == 0:
+    if not db.query(exists().where(Unit.id.isnot(None))).scalar():
         default_units = [
             Unit(
                 name="Linac 1",
@@ -88,6 +169,99 @@ def create_default_units(db: Session):
         print("Default units created")
 
 
+# =============================================================================
+# REQUEST BODY DEPENDENCIES
+# =============================================================================
+# Route handlers that use the sync Session are plain `def` functions so FastAPI
+# runs them in its threadpool and blocking SQLAlchemy calls never stall the
+# event loop (the JSON API routes use an AsyncSession instead). Form bodies
+# still have to be awaited, so they are read by an async dependency before
+# the handler is dispatched.
+
+async def get_form_data(request: Request) -> FormData:
+    """Read the submitted form."""
+    return await request.form()
+
+
+# =============================================================================
+# FORM PARSING HELPERS
+# =============================================================================
+
+# One comma-separated energy entry, e.g. "6MV" or "6MV FFF"; surrounding
+# whitespace is excluded and empty entries are skipped
+_ENERGY_RE = re.compile(r"[^\s,](?:[^,]*[^\s,])?")
+
+
+def parse_energy_list(value: str) -> list:
+    """Split a comma-separated energy list in a single regex scan."""
+    return _ENERGY_RE.findall(value)
+
+
+# =============================================================================
+# QUERY OPTIONS
+# =============================================================================
+
+# Report lists render unit names and pass/fail counts: batch-load both, and
+# raise on any other lazy load so a new N+1 in a template fails loudly
+REPORT_LIST_OPTIONS = (
+    selectinload(QAReport.tests),
+    selectinload(QAReport.unit),
+    raiseload("*")
+)
+
+
+# =============================================================================
+# PAGINATION HELPERS
+# =============================================================================
+
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(sort_value, row_id: int) -> str:
+    """Build a keyset cursor from the last row's sort value and id."""
+    return f"{sort_value.isoformat()},{row_id}"
+
+
+def decode_cursor(cursor: str, parse) -> tuple:
+    """Split a keyset cursor into (sort_value, id); 400 if malformed."""
+    try:
+        value, row_id = cursor.rsplit(",", 1)
+        return parse(value), int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_page(query, sort_column, id_column, cursor: Optional[str], parse, limit: int):
+    """
+    Return (rows, next_cursor) for a newest-first keyset page.
+    Rows are ordered by (sort_column, id_column) descending; the cursor marks
+    the last row of the previous page so each page is a single index range scan.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        value, row_id = decode_cursor(cursor, parse)
+        query = query.filter(or_(
+            sort_column < value,
+            and_(sort_column == value, id_column < row_id)
+        ))
+    
+    rows = query.order_by(sort_column.desc(), id_column.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
+
+
+def next_page_url(request: Request, next_cursor: Optional[str]) -> Optional[str]:
+    """Relative link to the next page, keeping the current filters."""
+    if not next_cursor:
+        return None
+    url = request.url.include_query_params(cursor=next_cursor)
+    return f"{url.path}?{url.query}"
+
+
 # =============================================================================
 # AUTHENTICATION ROUTES
 # =============================================================================
@@ -99,8 +273,9 @@ async def login_page(request: Request):
 
 
 @app.post("/login")
-async def login(
+def login(
     request: Request,
+    background_tasks: BackgroundTasks,
     username: str = Form(...),
     password: str = Form(...),
     db: Session = Depends(get_db)
@@ -108,7 +283,10 @@ async def login(
     """Process login form."""
     user = db.query(User).filter(User.username == username).first()
     
-    if not user or not verify_password(password, user.hashed_password):
+    verified, new_hash = (
+        verify_and_update_password(password, user.hashed_password) if user else (False, None)
+    )
+    if not verified:
         return templates.TemplateResponse(
             "login.html", 
             {"request": request, "error": "Invalid username or password"}
@@ -120,15 +298,19 @@ async def login(
             {"request": request, "error": "Account is disabled"}
         )
     
+    # Re-hash with current settings if the stored hash is outdated
+    if new_hash:
+        user.hashed_password = new_hash
+    
     # Update last login
     user.last_login = datetime.utcnow()
     db.commit()
     
     # Create session
-    token = create_session_token(user.id, user.username)
+    token = create_session_token(user.id)
     
     # Log audit
-    log_audit(db, user.username, "LOGIN", f"User logged in", request.client.host)
+    background_tasks.add_task(log_audit_deferred, user.username, "LOGIN", f"User logged in", request.client.host)
     
     response = RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
     response.set_cookie(
@@ -142,11 +324,11 @@ async def login(
 
 
 @app.get("/logout")
-async def logout(request: Request, db: Session = Depends(get_db)):
+def logout(request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     """Log out current user."""
     user = get_current_user(request, db)
     if user:
-        log_audit(db, user.username, "LOGOUT", "User logged out", request.client.host)
+        background_tasks.add_task(log_audit_deferred, user.username, "LOGOUT", "User logged out", request.client.host)
     
     response = RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
     response.delete_cookie(SESSION_COOKIE_NAME)
@@ -158,7 +340,7 @@ async def logout(request: Request, db: Session = Depends(get_db)):
 # =============================================================================
 
 @app.get("/", response_class=HTMLResponse)
-async def dashboard(request: Request, db: Session = Depends(get_db)):
+def dashboard(request: Request, db: Session = Depends(get_db)):
     """Main dashboard page."""
     user = get_current_user(request, db)
     if not user:
@@ -169,27 +351,31 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
     today = date.today()
     
     # Recent reports
-    recent_reports = db.query(QAReport).order_by(QAReport.created_at.desc()).limit(10).all()
+    recent_reports = db.query(QAReport).options(*REPORT_LIST_OPTIONS).order_by(
+        QAReport.created_at.desc()
+    ).limit(10).all()
+    
+    # QA due status - latest daily/monthly date for every unit in one query
+    last_dates = {
+        (unit_id, qa_type): last_date
+        for unit_id, qa_type, last_date in db.query(
+            QAReport.unit_id, QAReport.qa_type, func.max(QAReport.date)
+        ).filter(
+            QAReport.qa_type.in_(("daily", "monthly"))
+        ).group_by(QAReport.unit_id, QAReport.qa_type)
+    }
     
-    # QA due status
     qa_status = []
     for unit in units:
-        last_daily = db.query(QAReport).filter(
-            QAReport.unit_id == unit.id,
-            QAReport.qa_type == "daily"
-        ).order_by(QAReport.date.desc()).first()
-        
-        last_monthly = db.query(QAReport).filter(
-            QAReport.unit_id == unit.id,
-            QAReport.qa_type == "monthly"
-        ).order_by(QAReport.date.desc()).first()
+        last_daily = last_dates.get((unit.id, "daily"))
+        last_monthly = last_dates.get((unit.id, "monthly"))
         
         qa_status.append({
             "unit": unit,
-            "last_daily": last_daily.date if last_daily else None,
-            "last_monthly": last_monthly.date if last_monthly else None,
-            "daily_due": not last_daily or last_daily.date < today,
-            "monthly_due": not last_monthly or (today - last_monthly.date).days > 30
+            "last_daily": last_daily,
+            "last_monthly": last_monthly,
+            "daily_due": not last_daily or last_daily < today,
+            "monthly_due": not last_monthly or (today - last_monthly).days > 30
         })
     
     return templates.TemplateResponse("dashboard.html", {
@@ -203,7 +389,7 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
 
 
 @app.get("/qa/{qa_type}", response_class=HTMLResponse)
-async def qa_form(
+def qa_form(
     request: Request,
     qa_type: str,
     unit_id: Optional[int] = None,
@@ -236,9 +422,11 @@ async def qa_form(
 
 
 @app.post("/qa/{qa_type}")
-async def save_qa_report(
+def save_qa_report(
     request: Request,
     qa_type: str,
+    background_tasks: BackgroundTasks,
+    form_data: FormData = Depends(get_form_data),
     db: Session = Depends(get_db)
 ):
     """Save QA report."""
@@ -246,11 +434,9 @@ async def save_qa_report(
     if not user:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
     
-    form_data = await request.form()
-    
     # Create report
     report = QAReport(
-        date=datetime.strptime(form_data.get("qa_date"), "%Y-%m-%d").date(),
+        date=date.fromisoformat(form_data.get("qa_date")),
         qa_type=qa_type,
         unit_id=int(form_data.get("unit_id")),
         performer=form_data.get("performer"),
@@ -262,23 +448,23 @@ async def save_qa_report(
     db.add(report)
     db.flush()  # Get report ID
     
-    # Save individual tests
-    for test_def in SASQART_TESTS[qa_type]:
-        test_id = test_def["id"]
-        test = QATest(
-            report_id=report.id,
-            test_id=test_id,
-            status=form_data.get(f"status_{test_id}", ""),
-            notes=form_data.get(f"notes_{test_id}", "")
-        )
-        db.add(test)
+    # Save individual tests in one multi-row INSERT
+    db.execute(insert(QATest), [
+        {
+            "report_id": report.id,
+            "test_id": test_def.id,
+            "status": form_data.get(f"status_{test_def.id}", ""),
+            "notes": form_data.get(f"notes_{test_def.id}", "")
+        }
+        for test_def in SASQART_TESTS[qa_type]
+    ])
     
     db.commit()
     
     # Log audit
     unit = db.query(Unit).filter(Unit.id == report.unit_id).first()
-    log_audit(
-        db, user.username, "SAVE_QA",
+    background_tasks.add_task(
+        log_audit_deferred, user.username, "SAVE_QA",
         f"{qa_type.upper()} QA saved for {unit.name} on {report.date}",
         request.client.host
     )
@@ -287,15 +473,17 @@ async def save_qa_report(
 
 
 @app.get("/history", response_class=HTMLResponse)
-async def history_page(
+def history_page(
     request: Request,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     qa_type: Optional[str] = None,
     unit_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
     db: Session = Depends(get_db)
 ):
-    """Display QA history."""
+    """Display QA history, newest first, one page at a time."""
     user = get_current_user(request, db)
     if not user:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
@@ -306,8 +494,8 @@ async def history_page(
     if not start_date:
         start_date = (date.today() - timedelta(days=30)).isoformat()
     
-    # Build query
-    query = db.query(QAReport)
+    # Build query (tests/unit batch-loaded for the visible page only)
+    query = db.query(QAReport).options(*REPORT_LIST_OPTIONS)
     
     if start_date:
         query = query.filter(QAReport.date >= start_date)
@@ -318,13 +506,16 @@ async def history_page(
     if unit_id:
         query = query.filter(QAReport.unit_id == unit_id)
     
-    reports = query.order_by(QAReport.date.desc()).all()
+    reports, next_cursor = keyset_page(
+        query, QAReport.date, QAReport.id, cursor, date.fromisoformat, limit
+    )
     units = db.query(Unit).filter(Unit.active == True).all()
     
     return templates.TemplateResponse("history.html", {
         "request": request,
         "user": user,
         "reports": reports,
+        "next_url": next_page_url(request, next_cursor),
         "units": units,
         "start_date": start_date,
         "end_date": end_date,
@@ -334,7 +525,7 @@ async def history_page(
 
 
 @app.get("/report/{report_id}", response_class=HTMLResponse)
-async def view_report(
+def view_report(
     request: Request,
     report_id: int,
     db: Session = Depends(get_db)
@@ -348,18 +539,16 @@ async def view_report(
     if not report:
         raise HTTPException(status_code=404, detail="Report not found")
     
-    tests_dict = {t["id"]: t for t in SASQART_TESTS[report.qa_type]}
-    
     return templates.TemplateResponse("report_view.html", {
         "request": request,
         "user": user,
         "report": report,
-        "tests_dict": tests_dict
+        "tests_dict": SASQART_TESTS_BY_ID[report.qa_type]
     })
 
 
 @app.get("/trends", response_class=HTMLResponse)
-async def trends_page(
+def trends_page(
     request: Request,
     unit_id: Optional[int] = None,
     energy: Optional[str] = None,
@@ -395,12 +584,12 @@ async def trends_page(
         "selected_unit_id": unit_id,
         "selected_energy": energy,
         "days": days,
-        "trend_data": json.dumps(trend_data)
+        "trend_data": orjson.dumps(trend_data).decode()
     })
 
 
 @app.get("/units", response_class=HTMLResponse)
-async def units_page(request: Request, db: Session = Depends(get_db)):
+def units_page(request: Request, db: Session = Depends(get_db)):
     """Display unit configuration."""
     user = get_current_user(request, db)
     if not user:
@@ -416,8 +605,10 @@ async def units_page(request: Request, db: Session = Depends(get_db)):
 
 
 @app.post("/units")
-async def save_unit(
+def save_unit(
     request: Request,
+    background_tasks: BackgroundTasks,
+    form_data: FormData = Depends(get_form_data),
     db: Session = Depends(get_db)
 ):
     """Save unit configuration."""
@@ -425,7 +616,6 @@ async def save_unit(
     if not user:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
     
-    form_data = await request.form()
     unit_id = form_data.get("unit_id")
     
     if unit_id and unit_id != "new":
@@ -442,17 +632,18 @@ async def save_unit(
     
     install_date = form_data.get("install_date")
     if install_date:
-        unit.install_date = datetime.strptime(install_date, "%Y-%m-%d").date()
+        unit.install_date = date.fromisoformat(install_date)
     
     # Parse energy lists
-    unit.photon_energies = [e.strip() for e in form_data.get("photon_energies", "").split(",") if e.strip()]
-    unit.electron_energies = [e.strip() for e in form_data.get("electron_energies", "").split(",") if e.strip()]
-    unit.fff_energies = [e.strip() for e in form_data.get("fff_energies", "").split(",") if e.strip()]
+    unit.photon_energies = parse_energy_list(form_data.get("photon_energies", ""))
+    unit.electron_energies = parse_energy_list(form_data.get("electron_energies", ""))
+    unit.fff_energies = parse_energy_list(form_data.get("fff_energies", ""))
     
     db.commit()
+    invalidate_unit_cache(unit.id)
     
-    log_audit(
-        db, user.username, "SAVE_UNIT",
+    background_tasks.add_task(
+        log_audit_deferred, user.username, "SAVE_UNIT",
         f"Unit configuration saved: {unit.name} (S/N: {unit.serial_number})",
         request.client.host
     )
@@ -465,7 +656,7 @@ async def save_unit(
 # =============================================================================
 
 @app.get("/admin/users", response_class=HTMLResponse)
-async def users_page(request: Request, db: Session = Depends(get_db)):
+def users_page(request: Request, db: Session = Depends(get_db)):
     """User management page (admin only)."""
     user = get_current_user(request, db)
     if not user or user.role != "admin":
@@ -481,13 +672,17 @@ async def users_page(request: Request, db: Session = Depends(get_db)):
 
 
 @app.post("/admin/users")
-async def save_user(request: Request, db: Session = Depends(get_db)):
+def save_user(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    form_data: FormData = Depends(get_form_data),
+    db: Session = Depends(get_db)
+):
     """Create or update user."""
     current_user = get_current_user(request, db)
     if not current_user or current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    form_data = await request.form()
     user_id = form_data.get("user_id")
     
     if user_id and user_id != "new":
@@ -507,9 +702,10 @@ async def save_user(request: Request, db: Session = Depends(get_db)):
         user.hashed_password = hash_password(password)
     
     db.commit()
+    forget_active_user(user.id)
     
-    log_audit(
-        db, current_user.username, "SAVE_USER",
+    background_tasks.add_task(
+        log_audit_deferred, current_user.username, "SAVE_USER",
         f"User saved: {user.username}",
         request.client.host
     )
@@ -518,46 +714,54 @@ async def save_user(request: Request, db: Session = Depends(get_db)):
 
 
 @app.get("/admin/audit", response_class=HTMLResponse)
-async def audit_page(request: Request, db: Session = Depends(get_db)):
-    """Audit log page (admin only)."""
+def audit_page(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = 200,
+    db: Session = Depends(get_db)
+):
+    """Audit log page (admin only), newest first, one page at a time."""
     user = get_current_user(request, db)
     if not user or user.role != "admin":
         return RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
     
-    logs = db.query(AuditLog).order_by(AuditLog.timestamp.desc()).limit(200).all()
+    logs, next_cursor = keyset_page(
+        db.query(AuditLog), AuditLog.timestamp, AuditLog.id, cursor, datetime.fromisoformat, limit
+    )
     
     return templates.TemplateResponse("audit.html", {
         "request": request,
         "user": user,
-        "logs": logs
+        "logs": logs,
+        "next_url": next_page_url(request, next_cursor)
     })
 
 
 @app.get("/admin/backup")
-async def create_backup(request: Request, db: Session = Depends(get_db)):
+def create_backup(request: Request, db: Session = Depends(get_db)):
     """Create database backup."""
     user = get_current_user(request, db)
     if not user or user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
     backup_path = backup_database()
+    # Logged synchronously: the redirect target displays the audit log
     log_audit(db, user.username, "BACKUP", f"Database backup created: {backup_path}", request.client.host)
     
     return RedirectResponse(url="/admin/audit", status_code=status.HTTP_303_SEE_OTHER)
 
 
 @app.get("/admin/export")
-async def export_data(request: Request, db: Session = Depends(get_db)):
-    """Export all data as JSON."""
+def export_data(request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """Export all data as newline-delimited JSON, streamed in chunks."""
     user = get_current_user(request, db)
     if not user or user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    data = export_to_json()
-    log_audit(db, user.username, "EXPORT", "Full database export", request.client.host)
+    background_tasks.add_task(log_audit_deferred, user.username, "EXPORT", "Full database export", request.client.host)
     
-    return JSONResponse(content=data, headers={
-        "Content-Disposition": f"attachment; filename=linac_qa_export_{date.today().isoformat()}.json"
+    return StreamingResponse(iter_export_ndjson(), media_type="application/x-ndjson", headers={
+        "Content-Disposition": f"attachment; filename=linac_qa_export_{date.today().isoformat()}.ndjson"
     })
 
 
@@ -565,47 +769,137 @@ async def export_data(request: Request, db: Session = Depends(get_db)):
 # API ENDPOINTS (for AJAX calls)
 # =============================================================================
 
+@app.get("/api/tests")
+async def get_tests_api():
+    """Get all SASQART test definitions, grouped by QA type."""
+    return Response(content=SASQART_TESTS_JSON, media_type="application/json")
+
+
+# Encoded API responses kept in-process: unit_id -> (etag, body). Every
+# request still reads the unit row (one primary-key lookup), so a change saved
+# through any worker is seen immediately; the cached body is reused while the
+# row's updated_at is unchanged, and served as a stale copy if the DB fails.
+_unit_cache: dict[int, tuple[str, bytes]] = {}
+
+# Columns returned by /api/unit/{unit_id}, in response order
+UNIT_API_COLUMNS = (
+    Unit.id, Unit.name, Unit.manufacturer, Unit.model, Unit.serial_number,
+    Unit.location, Unit.photon_energies, Unit.electron_energies, Unit.fff_energies
+)
+
+# Built once at import; executed on a bare connection (no ORM Session)
+_GET_UNIT = select(*UNIT_API_COLUMNS, Unit.updated_at).where(Unit.id == bindparam("unit_id"))
+
+
+def invalidate_unit_cache(unit_id: int):
+    """Drop the cached API payload for a unit after it changes."""
+    _unit_cache.pop(unit_id, None)
+
+
+def unit_response(request: Request, etag: str, body: bytes) -> Response:
+    """Return 304 if the client already has this version, else the encoded JSON body."""
+    # no-cache: browsers must revalidate every time (cheap 304), so the QA
+    # form never builds its energy fields from an outdated unit
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.get("/api/unit/{unit_id}")
-async def get_unit_api(unit_id: int, db: Session = Depends(get_db)):
-    """Get unit details as JSON."""
-    unit = db.query(Unit).filter(Unit.id == unit_id).first()
-    if not unit:
+@max_queries(1)
+async def get_unit_api(unit_id: int, request: Request):
+    """Get unit details as JSON (ETag is derived from the unit's updated_at)."""
+    cached = _unit_cache.get(unit_id)
+    try:
+        # Core query on a pooled connection: no Session, ORM instance or
+        # identity-map bookkeeping
+        async with async_engine.connect() as conn:
+            row = (await conn.execute(_GET_UNIT, {"unit_id": unit_id})).first()
+    except SQLAlchemyError:
+        if cached:
+            return unit_response(request, *cached)  # Stale, but better than failing
+        raise
+    if not row:
+        invalidate_unit_cache(unit_id)
         raise HTTPException(status_code=404, detail="Unit not found")
     
-    return {
-        "id": unit.id,
-        "name": unit.name,
-        "manufacturer": unit.manufacturer,
-        "model": unit.model,
-        "serial_number": unit.serial_number,
-        "location": unit.location,
-        "photon_energies": unit.photon_energies,
-        "electron_energies": unit.electron_energies,
-        "fff_energies": unit.fff_energies
-    }
+    payload = dict(row._mapping)
+    updated_at = payload.pop("updated_at")
+    # updated_at is naive UTC; isoformat() avoids .timestamp() reading it as
+    # local time (two values could collide at a DST change)
+    etag = f'W/"{updated_at.isoformat() if updated_at else 0}"'
+    if cached and cached[0] == etag:
+        return unit_response(request, *cached)
+    
+    body = orjson.dumps(payload)
+    _unit_cache[unit_id] = (etag, body)
+    return unit_response(request, etag, body)
+
+
+class ReadingIn(BaseModel):
+    """One output constancy reading submitted to the API."""
+    date: date
+    unit_id: int
+    energy: str
+    reading: float
+    reference: float = Field(gt=0)  # deviation is relative to the reference
+
+
+# Core (table-level) insert: rows go straight to executemany without the ORM
+# bulk-persistence layer; the column's Python default still fills created_at.
+# No sort_by_parameter_order: on SQLite it makes SQLAlchemy send one INSERT
+# per row. Without it the rows go out as a single multi-row INSERT.
+_INSERT_OUTPUT_READINGS = insert(OutputReading.__table__).returning(OutputReading.__table__.c.id)
+
+
+async def insert_output_readings(db: AsyncSession, items: list[dict]) -> list:
+    """
+    Insert output readings with a multi-row INSERT ... RETURNING id.
+    Each item needs date, unit_id, energy, reading and reference; returns
+    {"id", "deviation"} dicts in the same order as items.
+    """
+    rows = [
+        {**item, "deviation": (item["reading"] - item["reference"]) / item["reference"] * 100}
+        for item in items
+    ]
+    result = await db.execute(_INSERT_OUTPUT_READINGS, rows)
+    # RETURNING output order is unspecified, but ids are allocated in VALUES
+    # order within our transaction, so ascending ids line up with rows
+    ids = sorted(result.scalars())
+    await db.commit()
+    return [{"id": id_, "deviation": row["deviation"]} for id_, row in zip(ids, rows)]
 
 
 @app.post("/api/output-reading")
-async def save_output_reading(request: Request, db: Session = Depends(get_db)):
+@max_queries(2)  # active-user check (when not cached) + INSERT
+async def save_output_reading(
+    body: ReadingIn,
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_async_db)
+):
     """Save an output reading for trend tracking."""
-    user = get_current_user(request, db)
-    if not user:
-        raise HTTPException(status_code=401, detail="Authentication required")
-    
-    data = await request.json()
+    [row] = await insert_output_readings(db, [body.model_dump()])
     
-    reading = OutputReading(
-        date=datetime.strptime(data["date"], "%Y-%m-%d").date(),
-        unit_id=data["unit_id"],
-        energy=data["energy"],
-        reading=data["reading"],
-        reference=data["reference"],
-        deviation=((data["reading"] - data["reference"]) / data["reference"]) * 100
-    )
-    db.add(reading)
-    db.commit()
+    return {"status": "ok", **row}
+
+
+# SQLAlchemy sends up to 1000 rows per INSERT statement; larger batches
+# would be split into several statements and break the query budget below
+MAX_READINGS_PER_BATCH = 1000
+
+
+@app.post("/api/output-readings/batch")
+@max_queries(2)  # active-user check (when not cached) + one multi-row INSERT
+async def save_output_readings_batch(
+    items: Annotated[list[ReadingIn], Field(max_length=MAX_READINGS_PER_BATCH)],
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Save all output readings from a QA session in one round-trip."""
+    rows = await insert_output_readings(db, [item.model_dump() for item in items]) if items else []
     
-    return {"status": "ok", "id": reading.id, "deviation": reading.deviation}
+    return {"status": "ok", "readings": rows}
 
 
 # =============================================================================
@@ -618,6 +912,16 @@ if __name__ == "__main__":
     print("Linac QA Management System")
     print("=" * 60)
     print(f"Starting server at http://localhost:8000")
-    print(f"Database: {os.path.join(BASE_DIR, 'data', 'linac_qa.db')}")
+    print(f"Database: {DATABASE_LOCATION}")
+    
+    # Worker processes for multi-core throughput; WAL mode lets them share SQLite.
+    # uvicorn picks uvloop/httptools automatically when installed.
+    workers = int(os.environ.get("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+    print(f"Workers: {workers}")
+    # Worker processes size their PostgreSQL pools from this (see database.py)
+    os.environ["WEB_CONCURRENCY"] = str(workers)
     print("=" * 60)
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    
+    initialize_database()
+    os.environ["LINAC_QA_DB_INITIALIZED"] = "1"
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers, log_level="warning")
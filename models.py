@@ -2,9 +2,17 @@
 SQLAlchemy ORM models for Linac QA System.
 """
 
+import re
+from collections import namedtuple
 from datetime import datetime, date
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Boolean, Text, ForeignKey, JSON
-from sqlalchemy.orm import relationship
+from functools import cached_property
+from types import MappingProxyType
+
+import orjson
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Boolean, Text, ForeignKey, JSON, Index
+from sqlalchemy import event
+from sqlalchemy.orm import relationship, object_session
+from sqlalchemy.orm.util import identity_key
 from database import Base
 
 
@@ -63,6 +71,14 @@ class Unit(Base):
 class QAReport(Base):
     """QA report header - one per QA session."""
     __tablename__ = "qa_reports"
+    __table_args__ = (
+        # Dashboard "last QA per unit and type" lookups
+        Index("ix_qa_unit_type_date", "unit_id", "qa_type", "date"),
+        # History page: date range filtered by QA type and unit
+        Index("ix_qareport_date_type_unit", "date", "qa_type", "unit_id"),
+        # History page for a single unit across all QA types
+        Index("ix_qa_unit_date", "unit_id", "date"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     date = Column(Date, nullable=False, index=True)
@@ -80,22 +96,35 @@ class QAReport(Base):
     
     # Relationships
     unit = relationship("Unit", back_populates="qa_reports")
-    tests = relationship("QATest", back_populates="report", cascade="all, delete-orphan")
+    # Pass/fail counts are shown wherever a report is, so always batch-load tests
+    tests = relationship("QATest", back_populates="report", cascade="all, delete-orphan", lazy="selectin")
     
     def __repr__(self):
         return f"<QAReport {self.qa_type} {self.date} Unit:{self.unit_id}>"
     
+    @cached_property
+    def _counts(self):
+        """(pass, fail, total) in one pass over tests; dropped when tests change."""
+        passed = failed = 0
+        for t in self.tests:
+            status = t.status
+            if status == "pass":
+                passed += 1
+            elif status == "fail":
+                failed += 1
+        return passed, failed, passed + failed
+    
     @property
     def pass_count(self):
-        return sum(1 for t in self.tests if t.status == "pass")
+        return self._counts[0]
     
     @property
     def fail_count(self):
-        return sum(1 for t in self.tests if t.status == "fail")
+        return self._counts[1]
     
     @property
     def total_tests(self):
-        return len([t for t in self.tests if t.status in ("pass", "fail")])
+        return self._counts[2]
 
 
 class QATest(Base):
@@ -120,6 +149,10 @@ class QATest(Base):
 class OutputReading(Base):
     """Output constancy readings for trend tracking."""
     __tablename__ = "output_readings"
+    __table_args__ = (
+        # Trends page: one unit/energy over a date window
+        Index("ix_outputreading_unit_energy_date", "unit_id", "energy", "date"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     date = Column(Date, nullable=False, index=True)
@@ -154,8 +187,38 @@ class AuditLog(Base):
         return f"<AuditLog {self.timestamp} {self.action}>"
 
 
+def _clear_report_counts(report):
+    """Forget a report's cached pass/fail counts."""
+    if report is not None:
+        report.__dict__.pop("_counts", None)
+
+
+@event.listens_for(QAReport.tests, "append")
+@event.listens_for(QAReport.tests, "remove")
+def _tests_changed(report, test, initiator):
+    _clear_report_counts(report)
+
+
+@event.listens_for(QAReport, "refresh")
+@event.listens_for(QAReport, "expire")
+def _report_reloaded(report, *args):
+    _clear_report_counts(report)
+
+
+@event.listens_for(QATest.status, "set")
+def _test_status_changed(test, value, oldvalue, initiator):
+    # Only a report already in memory can hold stale counts; look it up
+    # without triggering a load (test.report is unset when the tests were
+    # loaded from the report side)
+    report = test.__dict__.get("report")
+    session = object_session(test)
+    if report is None and session is not None and test.report_id is not None:
+        report = session.identity_map.get(identity_key(QAReport, test.report_id))
+    _clear_report_counts(report)
+
+
 # SASQART Test Definitions (reference data)
-SASQART_TESTS = {
+_SASQART_TEST_ROWS = {
     "daily": [
         {"id": "DL1", "description": "Door interlock", "tolerance": "Functional", "action": "Functional"},
         {"id": "DL2", "description": "Radiation beam status indicators", "tolerance": "Functional", "action": "Functional"},
@@ -209,3 +272,61 @@ SASQART_TESTS = {
         {"id": "AL18", "description": "Independent review", "tolerance": "Complete", "action": "Complete"},
     ]
 }
+
+# One SASQART test definition; immutable and lighter than a dict
+QATestDefinition = namedtuple("QATestDefinition", "id description tolerance action")
+
+# Read-only QA type -> tuple of test definitions, built once at import and
+# safe to share between requests and workers
+SASQART_TESTS = MappingProxyType({
+    qa_type: tuple(QATestDefinition(**row) for row in rows)
+    for qa_type, rows in _SASQART_TEST_ROWS.items()
+})
+
+# Per-QA-type lookup of test definitions by id
+SASQART_TESTS_BY_ID = {
+    qa_type: {t.id: t for t in tests}
+    for qa_type, tests in SASQART_TESTS.items()
+}
+
+# Lookup by id across all QA types (test ids are unique)
+SASQART_BY_ID = {t.id: t for tests in SASQART_TESTS.values() for t in tests}
+
+# Numeric limit parsed from a tolerance/action string, e.g. "2.00%" -> (2.0, "%").
+# Qualitative criteria ("Functional", "Complete", "Safe") have value None and
+# the criterion itself as unit
+Tolerance = namedtuple("Tolerance", "value unit")
+
+# Parsed tolerance and action levels of one test; each is a tuple of
+# Tolerance parts, all of which must hold (e.g. "1%/2mm" has two parts)
+TestLimits = namedtuple("TestLimits", "tolerance action")
+
+_TOLERANCE_RE = re.compile(r"<?\s*(\d+(?:\.\d+)?)\s*(%|mm|°|MU)")
+
+
+def _parse_tol(text: str) -> tuple[Tolerance, ...]:
+    """Parse a tolerance string such as "1 mm", "< 1 MU" or "1%/2mm"."""
+    if not any(ch.isdigit() for ch in text):
+        return (Tolerance(None, text),)
+    
+    parts = []
+    for part in text.split("/"):
+        match = _TOLERANCE_RE.fullmatch(part.strip())
+        if not match:
+            raise ValueError(f"Unrecognised SASQART tolerance: {text!r}")
+        parts.append(Tolerance(float(match.group(1)), match.group(2)))
+    return tuple(parts)
+
+
+# Test id -> parsed limits, so pass/fail checks compare floats instead of
+# re-parsing the strings on every evaluation
+SASQART_TESTS_PARSED = MappingProxyType({
+    t.id: TestLimits(_parse_tol(t.tolerance), _parse_tol(t.action))
+    for t in SASQART_BY_ID.values()
+})
+
+# Pre-encoded JSON of all definitions, served as-is by /api/tests
+SASQART_TESTS_JSON = orjson.dumps({
+    qa_type: [t._asdict() for t in tests]
+    for qa_type, tests in SASQART_TESTS.items()
+})